@@ -1,25 +1,314 @@
 import os
-from datetime import datetime
-from typing import List, Dict, Optional
-from pymongo import MongoClient
+import asyncio
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import List, Dict, Optional, Set, Tuple
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError, OperationFailure
+import orjson
 from dotenv import load_dotenv
 
+from redis_client import redis
+
 load_dotenv()
 
 # MongoDB connection
 MONGODB_URI = os.getenv("MONGODB_URI", "mongodb://localhost:27017/")
 DATABASE_NAME = "voice_assistant"
 
-# Initialize MongoDB client
-client = MongoClient(MONGODB_URI)
+# Initialize MongoDB client with a warm, bounded connection pool
+client = AsyncIOMotorClient(
+    MONGODB_URI,
+    maxPoolSize=50,
+    minPoolSize=10,
+    maxIdleTimeMS=60000,
+    waitQueueTimeoutMS=2000,
+    retryWrites=True,
+    compressors="zstd,zlib"
+)
 db = client[DATABASE_NAME]
 
 # Collections
 conversations_collection = db["conversations"]
 sessions_collection = db["sessions"]
 
+# Health check
+PING_TIMEOUT_SECONDS = 2
+
+# Data retention (enforced by TTL indexes)
+MESSAGE_TTL_SECONDS = 7 * 24 * 60 * 60
+SESSION_TTL_SECONDS = 24 * 60 * 60
+
+# Write batching
+BATCH_MAX_SIZE = 500
+BATCH_MAX_DELAY = 0.02  # seconds
+BATCH_MAX_IN_FLIGHT = 4
+
+
+class MongoBatcher:
+    """
+    Coalesces write operations from concurrent requests into unordered bulk_writes
+    Operations are buffered for up to max_delay seconds or max_size operations,
+    then flushed with one bulk_write per collection
+    """
+    
+    def __init__(
+        self,
+        max_size: int = BATCH_MAX_SIZE,
+        max_delay: float = BATCH_MAX_DELAY,
+        max_in_flight: int = BATCH_MAX_IN_FLIGHT
+    ):
+        self.max_size = max_size
+        self.max_delay = max_delay
+        self.max_in_flight = max_in_flight
+        self.queue: Optional[asyncio.Queue] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._flushes: Set[asyncio.Task] = set()
+    
+    def start(self):
+        """Start the background flush worker (call from the startup event)"""
+        self.queue = asyncio.Queue()
+        self._semaphore = asyncio.Semaphore(self.max_in_flight)
+        self._worker = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        """Stop the worker and flush everything still buffered"""
+        if self._worker is None:
+            return
+        
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        self._worker = None
+        
+        batch = []
+        while not self.queue.empty():
+            batch.append(self.queue.get_nowait())
+        if batch:
+            await self._flush(batch)
+        
+        if self._flushes:
+            await asyncio.gather(*self._flushes, return_exceptions=True)
+    
+    async def submit(self, collection, operation):
+        """
+        Queue a write operation and wait until its batch has been flushed
+        
+        Args:
+            collection: Motor collection the operation targets
+            operation: pymongo write operation (InsertOne, UpdateOne, ...)
+        
+        Raises:
+            Exception: The error reported by MongoDB for this operation
+        """
+        if self._worker is None:
+            # Batcher not running (e.g. outside the app lifecycle), write directly
+            await collection.bulk_write([operation], ordered=False)
+            return
+        
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((collection, operation, future))
+        await future
+    
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_delay
+            
+            try:
+                while len(batch) < self.max_size:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                    except asyncio.TimeoutError:
+                        break
+                
+                # Cap the number of bulk_writes running at once
+                await self._semaphore.acquire()
+            
+            except asyncio.CancelledError:
+                # Hand the partial batch back so stop() can flush it
+                for item in batch:
+                    self.queue.put_nowait(item)
+                raise
+            
+            flush = asyncio.create_task(self._flush(batch, release=True))
+            self._flushes.add(flush)
+            flush.add_done_callback(self._flushes.discard)
+    
+    async def _flush(self, batch: List[Tuple], release: bool = False):
+        try:
+            groups: Dict[str, Tuple] = {}
+            for collection, operation, future in batch:
+                _, operations, futures = groups.setdefault(
+                    collection.name, (collection, [], [])
+                )
+                operations.append(operation)
+                futures.append(future)
+            
+            await asyncio.gather(*(
+                self._write(collection, operations, futures)
+                for collection, operations, futures in groups.values()
+            ))
+        
+        finally:
+            if release:
+                self._semaphore.release()
+    
+    async def _write(self, collection, operations: List, futures: List[asyncio.Future]):
+        errors: Dict[int, Exception] = {}
+        try:
+            await collection.bulk_write(operations, ordered=False)
+        
+        except BulkWriteError as e:
+            for error in e.details.get("writeErrors", []):
+                errors[error["index"]] = OperationFailure(error.get("errmsg"), error.get("code"))
+        
+        except Exception as e:
+            errors = {index: e for index in range(len(futures))}
+        
+        for index, future in enumerate(futures):
+            if future.done():
+                continue
+            if index in errors:
+                future.set_exception(errors[index])
+            else:
+                future.set_result(True)
+
+
+batcher = MongoBatcher()
+
+# History cache (only used when Redis is configured)
+HISTORY_CACHE_TTL_SECONDS = 30
+
+
+def _history_key(session_id: str) -> str:
+    # One hash per session, one field per requested limit
+    return f"hist:{session_id}"
+
+
+async def _get_cached_history(session_id: str, limit: int) -> Optional[List[Dict]]:
+    if redis is None:
+        return None
+    try:
+        cached = await redis.hget(_history_key(session_id), str(limit))
+        return orjson.loads(cached) if cached is not None else None
+    except Exception as e:
+        print(f"Error reading history cache: {e}")
+        return None
+
+
+async def _cache_history(session_id: str, limit: int, history: List[Dict]):
+    if redis is None:
+        return
+    try:
+        async with redis.pipeline(transaction=False) as pipe:
+            pipe.hset(_history_key(session_id), str(limit), orjson.dumps(history))
+            pipe.expire(_history_key(session_id), HISTORY_CACHE_TTL_SECONDS)
+            await pipe.execute()
+    except Exception as e:
+        print(f"Error writing history cache: {e}")
+
+
+async def _invalidate_history(session_id: str):
+    if redis is None:
+        return
+    try:
+        await redis.delete(_history_key(session_id))
+    except Exception as e:
+        print(f"Error invalidating history cache: {e}")
+
+
+def _message_insert(session_id: str, role: str, content: str, timestamp: datetime) -> InsertOne:
+    return InsertOne({
+        "session_id": session_id,
+        "role": role,
+        "content": content,
+        "timestamp": timestamp
+    })
+
+
+# Session last_activity is refreshed at most once per interval per session
+SESSION_TOUCH_INTERVAL = timedelta(minutes=1)
+# Oldest touch first; entries older than the interval are dropped as new ones arrive
+_session_touches: "OrderedDict[str, datetime]" = OrderedDict()
+
+
+def _claim_session_touch(session_id: str, timestamp: datetime) -> bool:
+    """
+    Reserve the session upsert for this write if the interval has passed
+    The touch is recorded before the write so concurrent writes don't repeat it
+    """
+    last_touch = _session_touches.get(session_id)
+    if last_touch is not None and timestamp - last_touch < SESSION_TOUCH_INTERVAL:
+        return False
+    
+    _session_touches[session_id] = timestamp
+    _session_touches.move_to_end(session_id)
+    
+    # Expired entries would be due anyway, so forgetting them changes nothing
+    while _session_touches:
+        oldest_id, oldest_touch = next(iter(_session_touches.items()))
+        if timestamp - oldest_touch < SESSION_TOUCH_INTERVAL:
+            break
+        del _session_touches[oldest_id]
+    
+    return True
+
+
+def _release_session_touch(session_id: str, timestamp: datetime):
+    # Undo a claim whose write failed, so the next write retries the upsert
+    if _session_touches.get(session_id) == timestamp:
+        del _session_touches[session_id]
+
+
+def _session_upsert(session_id: str, timestamp: datetime) -> UpdateOne:
+    return UpdateOne(
+        {"session_id": session_id},
+        {
+            "$set": {"last_activity": timestamp},
+            "$setOnInsert": {"created_at": timestamp}
+        },
+        upsert=True
+    )
+
+
+async def _save_messages(session_id: str, inserts: List[InsertOne], timestamp: datetime):
+    """
+    Queue message inserts (plus a throttled session upsert) and wait for the flush
+    
+    Raises:
+        Exception: The first write error reported by MongoDB
+    """
+    writes = [batcher.submit(conversations_collection, insert) for insert in inserts]
+    
+    # Update session last activity
+    touch_session = _claim_session_touch(session_id, timestamp)
+    if touch_session:
+        writes.append(batcher.submit(sessions_collection, _session_upsert(session_id, timestamp)))
+    
+    try:
+        await asyncio.gather(*writes)
+    except Exception:
+        if touch_session:
+            _release_session_touch(session_id, timestamp)
+        raise
+    await _invalidate_history(session_id)
+
 
-def save_message(session_id: str, role: str, content: str) -> bool:
+async def save_message(
+    session_id: str,
+    role: str,
+    content: str,
+    timestamp: Optional[datetime] = None
+) -> bool:
     """
     Save a message to the database
     
@@ -27,28 +316,18 @@ def save_message(session_id: str, role: str, content: str) -> bool:
         session_id: Unique session identifier
         role: 'user' or 'assistant'
         content: Message content
+        timestamp: When the message was sent (defaults to now)
     
     Returns:
         bool: True if successful
     """
     try:
-        message = {
-            "session_id": session_id,
-            "role": role,
-            "content": content,
-            "timestamp": datetime.utcnow()
-        }
+        now = datetime.utcnow()
         
-        conversations_collection.insert_one(message)
-        
-        # Update session last activity
-        sessions_collection.update_one(
-            {"session_id": session_id},
-            {
-                "$set": {"last_activity": datetime.utcnow()},
-                "$setOnInsert": {"created_at": datetime.utcnow()}
-            },
-            upsert=True
+        await _save_messages(
+            session_id,
+            [_message_insert(session_id, role, content, timestamp or now)],
+            now
         )
         
         return True
@@ -58,7 +337,45 @@ def save_message(session_id: str, role: str, content: str) -> bool:
         return False
 
 
-def get_conversation_history(session_id: str, limit: int = 50) -> List[Dict]:
+async def save_turn(
+    session_id: str,
+    user_message: str,
+    assistant_message: str,
+    user_timestamp: Optional[datetime] = None
+) -> bool:
+    """
+    Save a full chat turn (user message + assistant reply) to the database
+    The writes are queued on the batcher and flushed together with other turns
+    
+    Args:
+        session_id: Unique session identifier
+        user_message: Message sent by the user
+        assistant_message: Response generated by the assistant
+        user_timestamp: When the user message was received (defaults to now)
+    
+    Returns:
+        bool: True if successful
+    """
+    try:
+        now = datetime.utcnow()
+        
+        await _save_messages(
+            session_id,
+            [
+                _message_insert(session_id, "user", user_message, user_timestamp or now),
+                _message_insert(session_id, "assistant", assistant_message, now)
+            ],
+            now
+        )
+        
+        return True
+    
+    except Exception as e:
+        print(f"Error saving turn: {e}")
+        return False
+
+
+async def get_conversation_history(session_id: str, limit: int = 50) -> List[Dict]:
     """
     Get conversation history for a session
     
@@ -70,22 +387,28 @@ def get_conversation_history(session_id: str, limit: int = 50) -> List[Dict]:
         List of messages
     """
     try:
+        # Serve warm sessions from the Redis cache
+        cached = await _get_cached_history(session_id, limit)
+        if cached is not None:
+            return cached
+        
         messages = conversations_collection.find(
-            {"session_id": session_id}
+            {"session_id": session_id},
+            {"_id": 0, "role": 1, "content": 1, "timestamp": 1}
         ).sort("timestamp", 1).limit(limit)
         
-        return [{
-            "role": msg["role"],
-            "content": msg["content"],
-            "timestamp": msg["timestamp"].isoformat()
-        } for msg in messages]
+        history = await messages.to_list(length=None)
+        
+        await _cache_history(session_id, limit, history)
+        
+        return history
     
     except Exception as e:
         print(f"Error retrieving conversation: {e}")
         return []
 
 
-def get_all_sessions(limit: int = 100) -> List[Dict]:
+async def get_all_sessions(limit: int = 100) -> List[Dict]:
     """
     Get all sessions with their last activity
     
@@ -96,20 +419,19 @@ def get_all_sessions(limit: int = 100) -> List[Dict]:
         List of sessions
     """
     try:
-        sessions = sessions_collection.find().sort("last_activity", -1).limit(limit)
+        sessions = sessions_collection.find(
+            {},
+            {"_id": 0, "session_id": 1, "created_at": 1, "last_activity": 1}
+        ).sort("last_activity", -1).limit(limit)
         
-        return [{
-            "session_id": session["session_id"],
-            "created_at": session["created_at"].isoformat(),
-            "last_activity": session["last_activity"].isoformat()
-        } for session in sessions]
+        return await sessions.to_list(length=None)
     
     except Exception as e:
         print(f"Error retrieving sessions: {e}")
         return []
 
 
-def delete_session(session_id: str) -> bool:
+async def delete_session(session_id: str) -> bool:
     """
     Delete a session and all its messages
     
@@ -120,8 +442,10 @@ def delete_session(session_id: str) -> bool:
         bool: True if successful
     """
     try:
-        conversations_collection.delete_many({"session_id": session_id})
-        sessions_collection.delete_one({"session_id": session_id})
+        await conversations_collection.delete_many({"session_id": session_id})
+        await sessions_collection.delete_one({"session_id": session_id})
+        _session_touches.pop(session_id, None)
+        await _invalidate_history(session_id)
         return True
     
     except Exception as e:
@@ -129,7 +453,7 @@ def delete_session(session_id: str) -> bool:
         return False
 
 
-def get_session_stats(session_id: str) -> Dict:
+async def get_session_stats(session_id: str) -> Dict:
     """
     Get statistics for a session
     
@@ -140,14 +464,20 @@ def get_session_stats(session_id: str) -> Dict:
         Dictionary with stats
     """
     try:
-        total_messages = conversations_collection.count_documents({"session_id": session_id})
-        user_messages = conversations_collection.count_documents({"session_id": session_id, "role": "user"})
-        assistant_messages = conversations_collection.count_documents({"session_id": session_id, "role": "assistant"})
+        # Count messages per role in a single pass
+        pipeline = [
+            {"$match": {"session_id": session_id}},
+            {"$group": {"_id": "$role", "count": {"$sum": 1}}}
+        ]
+        counts = {
+            group["_id"]: group["count"]
+            async for group in conversations_collection.aggregate(pipeline)
+        }
         
         return {
-            "total_messages": total_messages,
-            "user_messages": user_messages,
-            "assistant_messages": assistant_messages
+            "total_messages": sum(counts.values()),
+            "user_messages": counts.get("user", 0),
+            "assistant_messages": counts.get("assistant", 0)
         }
     
     except Exception as e:
@@ -155,8 +485,37 @@ def get_session_stats(session_id: str) -> Dict:
         return {}
 
 
-# Create indexes for better performance
-conversations_collection.create_index([("session_id", 1), ("timestamp", 1)])
-sessions_collection.create_index("session_id", unique=True)
+async def create_indexes():
+    """
+    Create indexes for better performance
+    Called once from the FastAPI startup event
+    """
+    await conversations_collection.create_index([("session_id", 1), ("timestamp", 1)])
+    # Lets the per-role stats aggregation run from the index alone
+    await conversations_collection.create_index([("session_id", 1), ("role", 1)])
+    await sessions_collection.create_index("session_id", unique=True)
+    
+    # Let MongoDB's TTL monitor expire old data
+    await conversations_collection.create_index("timestamp", expireAfterSeconds=MESSAGE_TTL_SECONDS)
+    await sessions_collection.create_index("last_activity", expireAfterSeconds=SESSION_TTL_SECONDS)
+
 
-print("✅ Database connected successfully")
\ No newline at end of file
+async def ping_database() -> bool:
+    """
+    Check that MongoDB is reachable
+    
+    Returns:
+        bool: True if the server answered the ping
+    """
+    try:
+        # Fail fast instead of waiting out server selection when Mongo is down
+        await asyncio.wait_for(client.admin.command("ping"), PING_TIMEOUT_SECONDS)
+        return True
+    
+    except asyncio.TimeoutError:
+        print("Error pinging database: timed out")
+        return False
+    
+    except Exception as e:
+        print(f"Error pinging database: {e}")
+        return False
\ No newline at end of file
@@ -1,21 +1,35 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from pydantic import BaseModel
-from typing import Optional, List, Dict
+from typing import Optional, List, Dict, Set
+from datetime import datetime
+import os
+import asyncio
+import orjson
 import uvicorn
 
 from session_manager import session_manager
-from openai_service import get_ai_response
+from redis_client import redis
+from openai_service import get_ai_response, stream_ai_response, http_client
 from database import (
     save_message, 
+    save_turn, 
     get_conversation_history, 
     get_all_sessions, 
     delete_session,
-    get_session_stats
+    get_session_stats,
+    create_indexes,
+    ping_database,
+    batcher
 )
 
 # Initialize FastAPI app
-app = FastAPI(title="Voice Assistant API", version="1.0.0")
+app = FastAPI(
+    title="Voice Assistant API",
+    version="1.0.0",
+    default_response_class=ORJSONResponse
+)
 
 # Enable CORS for React frontend 
 app.add_middleware(
@@ -42,52 +56,73 @@ class ResetRequest(BaseModel):
     session_id: str
 
 
+# Lifecycle
+@app.on_event("startup")
+async def startup():
+    """Create database indexes once the event loop is running"""
+    await create_indexes()
+    batcher.start()
+    print("✅ Database connected successfully")
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    """Flush any buffered database writes before exiting"""
+    if stream_saves:
+        await asyncio.gather(*stream_saves, return_exceptions=True)
+    await batcher.stop()
+    await http_client.aclose()
+    if redis is not None:
+        await redis.aclose()
+
+
 # Routes
 @app.get("/")
 async def root():
     """Health check endpoint"""
+    database_online = await ping_database()
     return {
         "status": "online",
         "service": "Voice Assistant API",
-        "version": "1.0.0"
+        "version": "1.0.0",
+        "database": "online" if database_online else "offline"
     }
 
 
 @app.post("/chat", response_model=ChatResponse)
-async def chat(request: ChatRequest):
+async def chat(request: ChatRequest, background_tasks: BackgroundTasks):
     """
     Main chat endpoint
     Receives user message, maintains context, returns AI response
     """
     try:
-        # Get conversation history
-        conversation = session_manager.get_conversation(request.session_id)
+        received_at = datetime.utcnow()
         
-        # Add user message
-        session_manager.add_message(
+        # Add user message and get the updated conversation
+        conversation = await session_manager.add_message(
             request.session_id,
             "user",
             request.message
         )
         
-        # Save user message to database
-        save_message(request.session_id, "user", request.message)
-        
-        # Get updated conversation
-        conversation = session_manager.get_conversation(request.session_id)
-        
         # Get AI response (mock or real based on .env)
-        ai_response = get_ai_response(conversation)
+        ai_response = await get_ai_response(conversation)
         
         # Add assistant response to history
-        session_manager.add_message(
+        await session_manager.add_message(
             request.session_id,
             "assistant",
             ai_response
         )
         
-        # Save assistant response to database
-        save_message(request.session_id, "assistant", ai_response)
+        # Save the whole turn to database after the response is sent
+        background_tasks.add_task(
+            save_turn,
+            request.session_id,
+            request.message,
+            ai_response,
+            received_at
+        )
         
         return ChatResponse(
             response=ai_response,
@@ -99,11 +134,79 @@ async def chat(request: ChatRequest):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+# Saves scheduled by /chat/stream (kept referenced until they finish)
+stream_saves: Set[asyncio.Task] = set()
+
+
+async def finish_stream_turn(request: ChatRequest, ai_response: str, received_at: datetime):
+    """Add the streamed response to history and save the whole turn"""
+    try:
+        if not ai_response:
+            # Nothing was streamed (e.g. the client left early): keep only the user message
+            await save_message(request.session_id, "user", request.message, received_at)
+            return
+        
+        await session_manager.add_message(
+            request.session_id,
+            "assistant",
+            ai_response
+        )
+        await save_turn(request.session_id, request.message, ai_response, received_at)
+    
+    except Exception as e:
+        print(f"Error saving streamed turn: {e}")
+
+
+@app.post("/chat/stream")
+async def chat_stream(request: ChatRequest):
+    """
+    Streaming chat endpoint
+    Same as /chat, but sends the AI response as Server-Sent Events while it is generated
+    """
+    try:
+        received_at = datetime.utcnow()
+        
+        # Add user message and get the updated conversation
+        conversation = await session_manager.add_message(
+            request.session_id,
+            "user",
+            request.message
+        )
+    
+    except Exception as e:
+        print(f"Error in chat stream endpoint: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    async def events():
+        tokens = []
+        try:
+            async for token in stream_ai_response(conversation):
+                tokens.append(token)
+                yield b"data: " + orjson.dumps({"token": token}) + b"\n\n"
+        
+        finally:
+            # Runs even if the client disconnects mid-stream; the save is not tied
+            # to the generator, so closing the stream can't cancel it
+            ai_response = "".join(tokens)
+            save = asyncio.create_task(
+                finish_stream_turn(request, ai_response, received_at)
+            )
+            stream_saves.add(save)
+            save.add_done_callback(stream_saves.discard)
+        
+        yield b"event: done\ndata: " + orjson.dumps({
+            "response": ai_response,
+            "session_id": request.session_id
+        }) + b"\n\n"
+    
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
 @app.post("/reset-session")
 async def reset_session(request: ResetRequest):
     """Reset conversation history for a session"""
     try:
-        session_manager.reset_session(request.session_id)
+        await session_manager.reset_session(request.session_id)
         return {"status": "success", "message": "Session reset successfully"}
     
     except Exception as e:
@@ -114,7 +217,7 @@ async def reset_session(request: ResetRequest):
 async def cleanup_sessions():
     """Cleanup old sessions (can be called periodically)"""
     try:
-        removed = session_manager.cleanup_old_sessions(max_age_hours=24)
+        removed = await session_manager.cleanup_old_sessions(max_age_hours=24)
         return {
             "status": "success",
             "sessions_removed": removed
@@ -128,12 +231,13 @@ async def cleanup_sessions():
 async def get_history(session_id: str, limit: int = 50):
     """Get conversation history from database"""
     try:
-        history = get_conversation_history(session_id, limit)
-        return {
+        history = await get_conversation_history(session_id, limit)
+        # Returned directly so orjson serializes the datetimes
+        return ORJSONResponse({
             "session_id": session_id,
             "messages": history,
             "count": len(history)
-        }
+        })
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -142,11 +246,12 @@ async def get_history(session_id: str, limit: int = 50):
 async def get_sessions(limit: int = 100):
     """Get all sessions"""
     try:
-        sessions = get_all_sessions(limit)
-        return {
+        sessions = await get_all_sessions(limit)
+        # Returned directly so orjson serializes the datetimes
+        return ORJSONResponse({
             "sessions": sessions,
             "count": len(sessions)
-        }
+        })
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -155,7 +260,7 @@ async def get_sessions(limit: int = 100):
 async def delete_session_endpoint(session_id: str):
     """Delete a session and its messages"""
     try:
-        success = delete_session(session_id)
+        success = await delete_session(session_id)
         if success:
             return {"status": "success", "message": "Session deleted"}
         else:
@@ -168,7 +273,7 @@ async def delete_session_endpoint(session_id: str):
 async def get_stats(session_id: str):
     """Get session statistics"""
     try:
-        stats = get_session_stats(session_id)
+        stats = await get_session_stats(session_id)
         return {
             "session_id": session_id,
             "stats": stats
@@ -182,4 +287,17 @@ if __name__ == "__main__":
     print("🚀 Starting Voice Assistant Backend...")
     print("📍 API will be available at: http://localhost:8000")
     print("📖 API docs available at: http://localhost:8000/docs")
-    uvicorn.run(app, host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
+    
+    dev_mode = os.getenv("ENV") == "dev"
+    # Workers only share sessions through Redis, so run a single worker without it
+    workers = os.cpu_count() if redis is not None and not dev_mode else 1
+    
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=8000,
+        loop="auto",  # uvloop when installed
+        http="auto",  # httptools when installed
+        workers=workers,
+        reload=dev_mode
+    )
\ No newline at end of file
@@ -1,13 +1,24 @@
 import os
+import re
 import random
-import time
-from typing import List, Dict
-from openai import OpenAI
+import asyncio
+from typing import List, Dict, AsyncIterator
+import httpx
+from openai import AsyncOpenAI
 from dotenv import load_dotenv
 
 load_dotenv()
 
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY", "sk-mock-key"))
+# Shared HTTP/2 connection pool, reused by every OpenAI request
+http_client = httpx.AsyncClient(
+    http2=True,
+    limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+)
+
+client = AsyncOpenAI(
+    api_key=os.getenv("OPENAI_API_KEY", "sk-mock-key"),
+    http_client=http_client,
+)
 
 # Mock responses for testing without API
 MOCK_RESPONSES = [
@@ -30,11 +41,36 @@ FAREWELL_RESPONSES = [
     "Take care! Feel free to come back anytime.",
 ]
 
+JOKES = [
+    "Why do programmers prefer dark mode? Because light attracts bugs!",
+    "Why did the developer go broke? Because they used up all their cache!",
+    "How many programmers does it take to change a light bulb? None, that's a hardware problem!",
+]
+
+# Category -> keyword patterns used by the mock pattern matching
+# Phrases come before the single words they contain ("what's up" before "what")
+MOCK_KEYWORDS = {
+    "how_are_you": [r"how are you", r"how's it going", r"what's up"],
+    "greeting": [r"hello", r"hi", r"hey", r"greetings"],
+    "farewell": [r"goodbye", r"bye", r"see you", r"later"],
+    "name": [r"names?"],
+    "name_qualifier": [r"your", r"what"],
+    "joke": [r"joke\w*"],  # joke, jokes, joker...
+}
+
+# Single pass over the message; each category is a named group
+MOCK_PATTERN = re.compile(
+    r"\b(?:" + "|".join(
+        f"(?P<{category}>" + "|".join(keywords) + ")"
+        for category, keywords in MOCK_KEYWORDS.items()
+    ) + r")\b"
+)
 
-def get_mock_response(messages: List[Dict]) -> str:
 
-    # Simulate API delay
-    time.sleep(random.uniform(0.5, 1.5))
+async def get_mock_response(messages: List[Dict]) -> str:
+
+    # Simulate API delay without blocking the event loop
+    await asyncio.sleep(random.uniform(0.5, 1.5))
     
     # Get the last user message
     last_message = ""
@@ -44,25 +80,22 @@ def get_mock_response(messages: List[Dict]) -> str:
             break
     
     # Pattern-based responses
-    if any(word in last_message for word in ["hello", "hi", "hey", "greetings"]):
+    found = {match.lastgroup for match in MOCK_PATTERN.finditer(last_message)}
+    
+    if "greeting" in found:
         return random.choice(GREETING_RESPONSES)
     
-    if any(word in last_message for word in ["bye", "goodbye", "see you", "later"]):
+    if "farewell" in found:
         return random.choice(FAREWELL_RESPONSES)
     
-    if any(word in last_message for word in ["how are you", "how's it going", "what's up"]):
+    if "how_are_you" in found:
         return "I'm doing great, thanks for asking! I'm currently in mock mode but all the voice features are working well."
     
-    if "name" in last_message and ("your" in last_message or "what" in last_message):
+    if "name" in found and "name_qualifier" in found:
         return "I'm your voice assistant! Right now I'm running in test mode with mock responses."
     
-    if "joke" in last_message:
-        jokes = [
-            "Why do programmers prefer dark mode? Because light attracts bugs!",
-            "Why did the developer go broke? Because they used up all their cache!",
-            "How many programmers does it take to change a light bulb? None, that's a hardware problem!",
-        ]
-        return random.choice(jokes)
+    if "joke" in found:
+        return random.choice(JOKES)
     
     if len(messages) > 5:  # Show context awareness
         return f"We've been chatting for a bit now! I'm keeping track of our {len(messages) - 1} message conversation in this session."
@@ -71,10 +104,10 @@ def get_mock_response(messages: List[Dict]) -> str:
     return random.choice(MOCK_RESPONSES)
 
 
-def get_openai_response(messages: List[Dict]) -> str:
+async def get_openai_response(messages: List[Dict]) -> str:
 
     try:
-        response = client.chat.completions.create(
+        response = await client.chat.completions.create(
             model="gpt-3.5-turbo",  # or "gpt-4" if you have access
             messages=messages,
             temperature=0.7,
@@ -87,7 +120,26 @@ def get_openai_response(messages: List[Dict]) -> str:
         return "I'm having trouble connecting to my AI brain right now. Please try again in a moment."
 
 
-def get_ai_response(messages: List[Dict], use_mock: bool = None) -> str:
+async def stream_openai_response(messages: List[Dict]) -> AsyncIterator[str]:
+
+    try:
+        stream = await client.chat.completions.create(
+            model="gpt-3.5-turbo",  # or "gpt-4" if you have access
+            messages=messages,
+            temperature=0.7,
+            max_tokens=150,  # Keep responses concise for voice
+            stream=True,
+        )
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    
+    except Exception as e:
+        print(f"OpenAI API Error: {e}")
+        yield "I'm having trouble connecting to my AI brain right now. Please try again in a moment."
+
+
+async def get_ai_response(messages: List[Dict], use_mock: bool = None) -> str:
     """
     Main function to get AI response
     Switches between mock and real based on environment variable
@@ -97,7 +149,24 @@ def get_ai_response(messages: List[Dict], use_mock: bool = None) -> str:
     
     if use_mock:
         print("🤖 Using MOCK response")
-        return get_mock_response(messages)
+        return await get_mock_response(messages)
     else:
         print("🤖 Using OPENAI API")
-        return get_openai_response(messages)
\ No newline at end of file
+        return await get_openai_response(messages)
+
+
+async def stream_ai_response(messages: List[Dict], use_mock: bool = None) -> AsyncIterator[str]:
+    """
+    Streaming variant of get_ai_response
+    Yields the response in chunks as they are generated
+    """
+    # FORCE OpenAI for testing
+    use_mock = False  # <-- FORCING to False
+    
+    if use_mock:
+        print("🤖 Using MOCK response (streaming)")
+        yield await get_mock_response(messages)
+    else:
+        print("🤖 Using OPENAI API (streaming)")
+        async for token in stream_openai_response(messages):
+            yield token
\ No newline at end of file
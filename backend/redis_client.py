@@ -0,0 +1,14 @@
+import os
+from typing import Optional
+from redis.asyncio import Redis
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Redis connection (optional - set REDIS_URL to share state between workers)
+REDIS_URL = os.getenv("REDIS_URL")
+
+# Initialize Redis client, or None when Redis is not configured
+redis: Optional[Redis] = (
+    Redis.from_url(REDIS_URL, decode_responses=True) if REDIS_URL else None
+)
@@ -1,53 +1,111 @@
-from typing import Dict, List
-from datetime import datetime, timedelta
+import json
+import time
+from collections import defaultdict, deque
+from typing import DefaultDict, Dict, List
+from redis.asyncio import Redis
+
+from redis_client import redis
+
+SYSTEM_MESSAGE = {
+    "role": "system",
+    "content": "You are a helpful voice assistant. Keep responses concise and conversational since they will be spoken aloud. Avoid using formatting like bullet points or numbered lists."
+}
+
+# Keep only last 20 messages to avoid token limits (system message not included)
+MAX_MESSAGES = 20
+SESSION_TTL_SECONDS = 24 * 60 * 60
+
+
+def _new_session() -> Dict:
+    # The deque drops the oldest message once the cap is reached
+    return {
+        "system": SYSTEM_MESSAGE,
+        "tail": deque(maxlen=MAX_MESSAGES),
+        "last": 0.0
+    }
+
 
 class SessionManager:
     def __init__(self):
-        # Store conversations: {session_id: [messages]}
-        self.sessions: Dict[str, List[Dict]] = {}
-        # Track when sessions were last accessed
-        self.last_accessed: Dict[str, datetime] = {}
-        
-    def get_conversation(self, session_id: str) -> List[Dict]:
-        if session_id not in self.sessions:
-            # Initialize new session with system message
-            self.sessions[session_id] = [
-                {
-                    "role": "system",
-                    "content": "You are a helpful voice assistant. Keep responses concise and conversational since they will be spoken aloud. Avoid using formatting like bullet points or numbered lists."
-                }
-            ]
-        
+        # Store sessions: {session_id: {"system": message, "tail": messages, "last": accessed}}
+        # New sessions are initialized with the system message on first access
+        self.sessions: DefaultDict[str, Dict] = defaultdict(_new_session)
+    
+    def _get_session(self, session_id: str) -> Dict:
+        session = self.sessions[session_id]
         # Update last accessed time
-        self.last_accessed[session_id] = datetime.now()
-        return self.sessions[session_id]
+        session["last"] = time.monotonic()
+        return session
     
-    def add_message(self, session_id: str, role: str, content: str):
-        conversation = self.get_conversation(session_id)
-        conversation.append({"role": role, "content": content})
-        
-        # Keep only last 20 messages to avoid token limits
-        # System message (index 0) + last 19 messages
-        if len(conversation) > 21:
-            self.sessions[session_id] = [conversation[0]] + conversation[-19:]
-    
-    def reset_session(self, session_id: str):
-        if session_id in self.sessions:
-            del self.sessions[session_id]
-        if session_id in self.last_accessed:
-            del self.last_accessed[session_id]
-    
-    def cleanup_old_sessions(self, max_age_hours: int = 24):
-        cutoff_time = datetime.now() - timedelta(hours=max_age_hours)
+    async def get_conversation(self, session_id: str) -> List[Dict]:
+        session = self._get_session(session_id)
+        return [session["system"], *session["tail"]]
+    
+    async def add_message(self, session_id: str, role: str, content: str) -> List[Dict]:
+        session = self._get_session(session_id)
+        session["tail"].append({"role": role, "content": content})
+        # Return the updated conversation so callers don't need to fetch it again
+        return [session["system"], *session["tail"]]
+    
+    async def reset_session(self, session_id: str):
+        self.sessions.pop(session_id, None)
+    
+    async def cleanup_old_sessions(self, max_age_hours: int = 24):
+        cutoff_time = time.monotonic() - max_age_hours * 60 * 60
         expired_sessions = [
-            sid for sid, last_time in self.last_accessed.items()
-            if last_time < cutoff_time
+            sid for sid, session in self.sessions.items()
+            if session["last"] < cutoff_time
         ]
         
         for session_id in expired_sessions:
-            self.reset_session(session_id)
+            await self.reset_session(session_id)
         
         return len(expired_sessions)
 
+
+class RedisSessionManager:
+    """
+    Session store shared by all workers
+    Each conversation is a Redis list of JSON messages under sess:{session_id};
+    the system message is not stored and is prepended on read
+    """
+    
+    def __init__(self, client: Redis):
+        self.redis = client
+    
+    @staticmethod
+    def _key(session_id: str) -> str:
+        return f"sess:{session_id}"
+    
+    async def get_conversation(self, session_id: str) -> List[Dict]:
+        key = self._key(session_id)
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.lrange(key, 0, -1)
+            # Sliding expiry replaces cleanup_old_sessions
+            pipe.expire(key, SESSION_TTL_SECONDS)
+            messages, _ = await pipe.execute()
+        
+        return [SYSTEM_MESSAGE] + [json.loads(message) for message in messages]
+    
+    async def add_message(self, session_id: str, role: str, content: str) -> List[Dict]:
+        key = self._key(session_id)
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.rpush(key, json.dumps({"role": role, "content": content}))
+            pipe.ltrim(key, -MAX_MESSAGES, -1)
+            pipe.expire(key, SESSION_TTL_SECONDS)
+            # Read back the updated conversation in the same round-trip
+            pipe.lrange(key, 0, -1)
+            *_, messages = await pipe.execute()
+        
+        return [SYSTEM_MESSAGE] + [json.loads(message) for message in messages]
+    
+    async def reset_session(self, session_id: str):
+        await self.redis.delete(self._key(session_id))
+    
+    async def cleanup_old_sessions(self, max_age_hours: int = 24):
+        # Redis expires idle sessions on its own
+        return 0
+
+
 # Global instance
-session_manager = SessionManager()
\ No newline at end of file
+session_manager = RedisSessionManager(redis) if redis is not None else SessionManager()